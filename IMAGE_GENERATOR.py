@@ -1,8 +1,38 @@
+import os
+import sys
+
+# Let the CUDA caching allocator grow segments instead of fragmenting; must be set before torch starts CUDA.
+# Windows doesn't support expandable segments (torch warns on every start), so leave the default there.
+if sys.platform != "win32":
+    os.environ.setdefault("PYTORCH_CUDA_ALLOC_CONF", "expandable_segments:True")
+
 import torch
 import customtkinter as ctk
 from PIL import Image, ImageTk
-from diffusers import StableDiffusionPipeline
+from diffusers import StableDiffusionPipeline, DPMSolverMultistepScheduler
 import threading
+import queue
+import importlib.util
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+# Let cuDNN autotune convs for the fixed latent shape and allow TF32 on Ampere+
+torch.backends.cudnn.benchmark = True
+torch.backends.cuda.matmul.allow_tf32 = True
+torch.backends.cudnn.allow_tf32 = True
+
+# Most prompts the worker will run in one pipeline call (2 fits on an 8GB card)
+MAX_BATCH = 2
+
+# Saves run here so writing results to disk never delays the next generation
+_io_pool = ThreadPoolExecutor(max_workers=1)
+
+def vram_gb():
+    return torch.cuda.get_device_properties(0).total_memory / 1024**3
+
+def inductor_available():
+    # torch.compile's default backend generates Triton kernels, which Windows doesn't support
+    return sys.platform != "win32" and importlib.util.find_spec("triton") is not None
 
 # 1. System Configuration
 ctk.set_appearance_mode("Dark")
@@ -20,10 +50,59 @@ class SamImageGenerator(ctk.CTk):
         self.device = "cuda" if torch.cuda.is_available() else "cpu"
         
         # We load in float16 to save 50% VRAM without losing noticeable quality
+        load_kwargs = {
+            "torch_dtype": torch.float16 if self.device == "cuda" else torch.float32,
+            "use_safetensors": True,
+            "safety_checker": None,
+            "requires_safety_checker": False,
+        }
+        if self.device == "cuda":
+            # Fetch the fp16 weights directly instead of downloading fp32 and casting
+            load_kwargs["variant"] = "fp16"
+
         self.pipe = StableDiffusionPipeline.from_pretrained(
             self.model_id, 
-            torch_dtype=torch.float16 if self.device == "cuda" else torch.float32
-        ).to(self.device)
+            **load_kwargs
+        )
+
+        # On small GPUs keep the weights on the host and move each submodule over only while it runs
+        self.offload = self.device == "cuda" and vram_gb() < 6
+        if self.offload:
+            self.pipe.enable_model_cpu_offload()
+        else:
+            self.pipe = self.pipe.to(self.device)
+
+        # DPM-Solver++ reaches the same quality in ~20 steps instead of PNDM's 30+
+        self.pipe.scheduler = DPMSolverMultistepScheduler.from_config(
+            self.pipe.scheduler.config,
+            algorithm_type="dpmsolver++",
+            use_karras_sigmas=True
+        )
+
+        # Compile the UNet and VAE decoder; shapes are static so CUDA graphs remove launch overhead
+        # (skipped when offloading, since CUDA graphs can't follow weights moving between devices)
+        self.eager_unet = self.pipe.unet
+        self.eager_decode = self.pipe.vae.decode
+        if self.device == "cuda" and not self.offload and inductor_available():
+            try:
+                self.pipe.unet = torch.compile(self.pipe.unet, mode="reduce-overhead", fullgraph=False)
+                self.pipe.vae.decode = torch.compile(self.pipe.vae.decode, mode="reduce-overhead")
+            except Exception:
+                self.restore_eager()
+
+        # Keep attention memory in check on 8GB cards; xformers is faster when installed.
+        # Without it, torch 2.x already uses fused SDPA attention, which beats slicing,
+        # so only slice on older torch builds that lack it
+        if self.device == "cuda":
+            try:
+                self.pipe.enable_xformers_memory_efficient_attention()
+            except Exception:
+                if not hasattr(torch.nn.functional, "scaled_dot_product_attention"):
+                    self.pipe.enable_attention_slicing("auto")
+
+        # Decode one latent at a time in tiles; a no-op at 512x512 but avoids OOM at larger sizes
+        self.pipe.vae.enable_slicing()
+        self.pipe.vae.enable_tiling()
 
         # UI Elements
         self.header = ctk.CTkLabel(
@@ -54,41 +133,167 @@ class SamImageGenerator(ctk.CTk):
         # Placeholder for the image
         self.image_display = ctk.CTkLabel(self, text="", width=512, height=512)
         self.image_display.pack(pady=20)
+        # Clicking the image steps through the other results of a batched generation
+        self.image_display.bind("<Button-1>", lambda event: self.show_next())
+        self.batch = []
+        self.batch_index = 0
 
-        self.status_label = ctk.CTkLabel(self, text="Ready", text_color="gray")
+        # The worker warms up the GPU pipeline before taking jobs (see _worker)
+        status = "Warming up..." if self.device == "cuda" else "Ready"
+        self.status_label = ctk.CTkLabel(self, text=status, text_color="gray")
         self.status_label.pack(pady=5)
 
+        # Prompts queued or running; only touched on the Tk main loop
+        self.pending = 0
+
+        # One persistent worker runs every generation, so CUDA allocator state stays warm
+        # and overlapping requests are serialized instead of competing for VRAM
+        self._job_q = queue.Queue()
+        threading.Thread(target=self._worker, daemon=True).start()
+
+    def _worker(self):
+        # Warm up first so the first real generation is already fast. On CPU there is no
+        # cuDNN cache or compiled graph to warm, so it would only delay the first job
+        if self.device == "cuda":
+            try:
+                self.warmup()
+            except Exception as e:
+                if self.pipe.unet is not self.eager_unet:
+                    # Compile errors only surface on the first call and would repeat on every
+                    # job, so drop back to the uncompiled modules and warm those up instead
+                    self.restore_eager()
+                    self.after(0, self.show_error, f"torch.compile failed, running uncompiled: {e}")
+                    try:
+                        self.warmup()
+                    except Exception as e:
+                        self.after(0, self.show_error, f"Warm-up failed: {e}")
+                else:
+                    # Keep serving jobs; a real problem will be reported by the job itself
+                    self.after(0, self.show_error, f"Warm-up failed: {e}")
+            else:
+                self.after(0, self.finish_warmup)
+        while True:
+            prompts = [self._job_q.get()]
+            # Batch any other queued prompts into the same call to amortize the per-step overhead
+            while len(prompts) < MAX_BATCH:
+                try:
+                    prompts.append(self._job_q.get_nowait())
+                except queue.Empty:
+                    break
+            try:
+                images, errors = self.generate_image(prompts)
+            except Exception as e:
+                # Never let an error kill the worker, or every later job would wait forever
+                images, errors = [], [str(e)]
+            # Tkinter isn't thread-safe, so hand the results back to the main loop
+            self.after(0, self.finish_jobs, len(prompts), images, errors)
+            # No torch.cuda.empty_cache()/gc.collect() here: every step reuses the same
+            # tensor shapes, so the cached blocks are exactly what the next generation needs,
+            # and emptying the cache costs hundreds of ms for nothing
+
+    def restore_eager(self):
+        self.pipe.unet = self.eager_unet
+        self.pipe.vae.decode = self.eager_decode
+
+    def warmup(self):
+        # A short dummy run fills the cuDNN algorithm cache, loads the CUDA kernels and
+        # pays the torch.compile cost. It covers every batch size the worker can send and
+        # keeps the default guidance, so the UNet sees the same shapes as a real generation
+        # and nothing is recompiled or re-captured later
+        with torch.inference_mode():
+            for batch_size in range(1, MAX_BATCH + 1):
+                self.pipe(["warmup"] * batch_size, num_inference_steps=2)
+
+    def finish_warmup(self):
+        # Leave the status alone if prompts were queued while warming up
+        if not self.pending:
+            self.status_label.configure(text="Ready", text_color="gray")
+
     def start_generation(self):
-        # Run generation in a separate thread so the UI doesn't freeze
+        # Hand the prompt to the worker thread so the UI doesn't freeze
         prompt = self.prompt_entry.get()
         if not prompt:
             self.status_label.configure(text="Please enter a prompt first!", text_color="red")
             return
             
-        self.gen_button.configure(state="disabled", text="Generating...")
-        self.status_label.configure(text="Processing AI model...", text_color="yellow")
+        # The button stays enabled so prompts can be queued (and batched) while one is running
+        self.pending += 1
+        self.status_label.configure(text=f"Processing AI model... ({self.pending} queued)", text_color="yellow")
         
-        thread = threading.Thread(target=self.generate_image, args=(prompt,))
-        thread.start()
+        self._job_q.put(prompt)
 
-    def generate_image(self, prompt):
+    def generate_image(self, prompts):
+        # Runs on the worker thread and returns (images, errors) without touching the UI
         try:
-            # Inference (num_inference_steps=30 is a good balance for 8GB VRAM speed)
-            with torch.autocast("cuda"):
-                image = self.pipe(prompt, num_inference_steps=30).images[0]
-            
-            # Save and Update UI
-            image.save("generated.png")
-            
-            # Convert for Tkinter
-            img_ctk = ctk.CTkImage(light_image=image, dark_image=image, size=(450, 450))
-            
-            self.image_display.configure(image=img_ctk)
-            self.status_label.configure(text="Generation Complete!", text_color="green")
+            return self.run_pipe(prompts), []
         except Exception as e:
-            self.status_label.configure(text=f"Error: {str(e)}", text_color="red")
-        finally:
-            self.gen_button.configure(state="normal", text="Generate Image")
+            if len(prompts) == 1:
+                return [], [str(e)]
+
+        # Retry one at a time so a single bad prompt only fails its own job
+        images, errors = [], []
+        for prompt in prompts:
+            try:
+                images += self.run_pipe([prompt])
+            except Exception as e:
+                errors.append(str(e))
+        return images, errors
+
+    def run_pipe(self, prompts):
+        # Inference (num_inference_steps=20 is enough with DPM-Solver++)
+        # The weights are already fp16, so autocast would only add casts around every op
+        with torch.inference_mode():
+            return self.pipe(prompts, num_inference_steps=20).images
+
+    def finish_jobs(self, count, images, errors):
+        self.pending -= count
+        if images:
+            self.update_ui(images)
+
+        if errors:
+            self.show_error(errors[-1])
+        elif self.pending:
+            self.status_label.configure(text=f"Processing AI model... ({self.pending} queued)", text_color="yellow")
+        elif len(images) > 1:
+            self.status_label.configure(
+                text=f"Generated {len(images)} images - click the image to see the others",
+                text_color="green"
+            )
+        else:
+            self.status_label.configure(text="Generation Complete!", text_color="green")
+
+    def update_ui(self, images):
+        # Save every result as a timestamped JPEG (much cheaper to encode than PNG) in the background;
+        # nanosecond timestamps keep names unique across generations finishing in the same second
+        timestamp = time.time_ns()
+        for i, img in enumerate(images):
+            path = f"generated_{timestamp}_{i}.jpg"
+            future = _io_pool.submit(img.save, path, quality=92)
+            future.add_done_callback(lambda future, path=path: self.report_save(future, path))
+
+        # Show the most recent prompt's result; the rest of the batch is a click away
+        self.batch = images
+        self.batch_index = len(images) - 1
+        self.show_image(images[-1])
+
+    def show_next(self):
+        if len(self.batch) > 1:
+            self.batch_index = (self.batch_index + 1) % len(self.batch)
+            self.show_image(self.batch[self.batch_index])
+
+    def show_image(self, image):
+        # Convert for Tkinter at the native 512x512 output size so no resample is needed
+        img_ctk = ctk.CTkImage(light_image=image, dark_image=image, size=image.size)
+        self.image_display.configure(image=img_ctk)
+
+    def report_save(self, future, path):
+        # Called on the I/O thread, so hand any failure back to the main loop
+        error = future.exception()
+        if error is not None:
+            self.after(0, self.show_error, f"Could not save {path}: {error}")
+
+    def show_error(self, message):
+        self.status_label.configure(text=f"Error: {message}", text_color="red")
 
 if __name__ == "__main__":
     app = SamImageGenerator()
@@ -2,6 +2,7 @@ import streamlit as st
 import torch
 from diffusers import StableDiffusionPipeline
 from PIL import Image
+import io
 
 # 1. Page Configuration
 st.set_page_config(page_title="SAM Image Generator", page_icon="🎨")
@@ -54,10 +55,13 @@ if st.button("Generate Image", type="primary"):
                 # Display Result
                 st.image(image, caption=f"Generated: {prompt}", use_container_width=True)
                 
-                # Download Button
+                # Download Button (encode the PNG once in memory instead of writing generated.png to disk)
+                buf = io.BytesIO()
+                image.save(buf, format="PNG")
+                buf.seek(0)
                 st.download_button(
                     label="Download Image",
-                    data=open("generated.png", "rb") if image.save("generated.png") else image.save("generated.png") or open("generated.png", "rb"),
+                    data=buf,
                     file_name="generated_image.png",
                     mime="image/png"
                 )
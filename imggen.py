@@ -1,7 +1,10 @@
 import streamlit as st
 import requests
 import io
+import random
 from PIL import Image
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 
 # ── Page Config ──────────────────────────────────────────────
 st.set_page_config(
@@ -16,41 +19,87 @@ MODELS = {
     "✅ Stable Diffusion 2.1 (Fast & Reliable)": "stabilityai/stable-diffusion-2-1",
     "✅ Openjourney v4 (Artistic / MidJourney style)": "prompthero/openjourney-v4",
     "✅ Realistic Vision v3 (Photorealistic)":   "SG161222/Realistic_Vision_V3.0_VAE",
+    "✅ Stable Diffusion XL 1.0 (High Resolution)": "stabilityai/stable-diffusion-xl-base-1.0",
 }
 
 BASE_URL = "https://router.huggingface.co/hf-inference/models"
 
+# ── HTTP Session ──────────────────────────────────────────────
+# Reuse one keep-alive connection so only the first request pays the TLS handshake.
+# A 503 means the model is still loading, so retry it a couple of times before giving up.
+# Read timeouts and mid-request errors are never retried: the POST already reached HF and
+# re-sending it would start another generation job (and triple the wait on a busy model).
+# Cached as a resource because Streamlit re-executes module-level code on every rerun.
+@st.cache_resource
+def _session() -> requests.Session:
+    session = requests.Session()
+    session.mount(
+        "https://",
+        HTTPAdapter(
+            pool_connections=2,
+            pool_maxsize=4,
+            max_retries=Retry(
+                total=2,
+                connect=2,
+                read=False,
+                other=0,
+                backoff_factor=0.5,
+                status_forcelist=[503],
+                allowed_methods=["POST"],
+                raise_on_status=False,
+            ),
+        ),
+    )
+    return session
+
 
 # ── Query Function ────────────────────────────────────────────
 def query(hf_token: str, model_id: str, payload: dict):
     api_url = f"{BASE_URL}/{model_id}"
-    headers = {"Authorization": f"Bearer {hf_token}"}
+    # Ask for JPEG, which decodes several times faster than PNG (any other image type still works)
+    headers = {"Authorization": f"Bearer {hf_token}", "Accept": "image/jpeg"}
 
     try:
-        response = requests.post(api_url, headers=headers, json=payload, timeout=120)
-
-        if response.status_code == 401:
-            st.error("❌ Invalid token — please double-check your Hugging Face API token.")
-            return None
-        elif response.status_code == 403:
-            st.error(
-                "❌ Access denied for this model. Try a different model from the dropdown, "
-                "or accept the license at huggingface.co/models"
-            )
-            return None
-        elif response.status_code == 503:
-            st.warning("⏳ Model is loading on HF servers. Wait 20–30 sec and try again.")
-            return None
-        elif response.status_code != 200:
-            st.error(f"❌ API Error {response.status_code}: {response.text[:300]}")
-            return None
-
-        content_type = response.headers.get("Content-Type", "")
-        if "image" not in content_type:
-            st.error(f"❌ Unexpected response (not an image): {response.text[:300]}")
-            return None
-
-        return response.content
+        # The context manager releases the pooled connection on every return path
+        with _session().post(api_url, headers=headers, json=payload, timeout=120, stream=True) as response:
+            if response.status_code != 200:
+                # Read the (small) error body so the connection is reused rather than closed
+                error_text = response.text[:300]
+
+            if response.status_code == 401:
+                st.error("❌ Invalid token — please double-check your Hugging Face API token.")
+                return None
+            elif response.status_code == 403:
+                st.error(
+                    "❌ Access denied for this model. Try a different model from the dropdown, "
+                    "or accept the license at huggingface.co/models"
+                )
+                return None
+            elif response.status_code == 503:
+                st.warning("⏳ Model is loading on HF servers. Wait 20–30 sec and try again.")
+                return None
+            elif response.status_code != 200:
+                st.error(f"❌ API Error {response.status_code}: {error_text}")
+                return None
+
+            content_type = response.headers.get("Content-Type", "")
+            if "image" not in content_type:
+                st.error(f"❌ Unexpected response (not an image): {response.text[:300]}")
+                return None
+
+            # Read the body in chunks so the user sees download progress instead of a frozen spinner
+            total = int(response.headers.get("Content-Length", 0))
+            progress = st.progress(0.0, text="⬇️ Downloading image...") if total else None
+            chunks, received = [], 0
+            for chunk in response.iter_content(chunk_size=64 * 1024):
+                chunks.append(chunk)
+                received += len(chunk)
+                if progress:
+                    progress.progress(min(received / total, 1.0), text="⬇️ Downloading image...")
+            if progress:
+                progress.empty()
+
+            return b"".join(chunks)
 
     except requests.exceptions.Timeout:
         st.error("❌ Request timed out — model may be busy. Please try again.")
@@ -60,6 +109,27 @@ def query(hf_token: str, model_id: str, payload: dict):
         return None
 
 
+# ── Cached Helpers ────────────────────────────────────────────
+class QueryFailed(Exception):
+    """Raised after query() has reported an error, so the failure is not cached."""
+
+
+@st.cache_data(max_entries=16, show_spinner=False)
+def _generate(hf_token: str, model_id: str, payload: dict) -> bytes:
+    # Identical requests (same model, prompt, settings and seed) are served from the cache
+    image_bytes = query(hf_token, model_id, payload)
+    if image_bytes is None:
+        raise QueryFailed
+    return image_bytes
+
+
+@st.cache_data(max_entries=4, show_spinner=False)
+def _decode_image(image_bytes: bytes) -> tuple[Image.Image, str]:
+    # Reruns (e.g. clicking download) reuse the decoded image instead of decoding again
+    image = Image.open(io.BytesIO(image_bytes))
+    return image.copy(), image.format or "PNG"
+
+
 # ── Sidebar ───────────────────────────────────────────────────
 with st.sidebar:
     st.header("🔑 API Configuration")
@@ -114,6 +184,13 @@ with col2:
     guidance = st.slider("Guidance Scale", 1.0, 15.0, 7.5, 0.5,
                          help="Higher = image follows prompt more strictly.")
 
+col3, col4 = st.columns(2)
+with col3:
+    random_seed = st.checkbox("🎲 New variation every time", value=True,
+                              help="Untick to reuse a fixed seed and get the same image back.")
+with col4:
+    fixed_seed = st.number_input("Seed", 0, 2**32 - 1, 0, disabled=random_seed)
+
 st.divider()
 
 # ── Generate ──────────────────────────────────────────────────
@@ -134,26 +211,32 @@ if st.button("✨ Generate Image", type="primary", use_container_width=True):
                 "negative_prompt": negative_prompt.strip(),
                 "num_inference_steps": steps,
                 "guidance_scale": guidance,
+                # The seed is part of the cache key, so a random one gives a fresh image per click
+                "seed": random.randint(0, 2**32 - 1) if random_seed else int(fixed_seed),
             }
         }
-        image_bytes = query(hf_token.strip(), selected_model, payload)
-
-    if image_bytes:
         try:
-            image = Image.open(io.BytesIO(image_bytes))
-            st.success("✅ Image generated successfully!")
-            st.image(image, caption=f'"{prompt}"', use_container_width=True)
-
-            buf = io.BytesIO()
-            image.save(buf, format="PNG")
-            buf.seek(0)
-
-            st.download_button(
-                label="⬇️ Download Image (PNG)",
-                data=buf.getvalue(),
-                file_name="generated_image.png",
-                mime="image/png",
-                use_container_width=True
-            )
-        except Exception as e:
-            st.error(f"❌ Could not render image: {str(e)}")
+            # Keep the result across reruns so clicking download doesn't make it disappear
+            st.session_state["result"] = (_generate(hf_token.strip(), selected_model, payload), prompt)
+        except QueryFailed:
+            st.session_state.pop("result", None)
+
+# ── Result ────────────────────────────────────────────────────
+# Rendered outside the button block, so reruns redraw it from the cached decode
+if "result" in st.session_state:
+    image_bytes, result_prompt = st.session_state["result"]
+    try:
+        image, image_format = _decode_image(image_bytes)
+        st.success("✅ Image generated successfully!")
+        st.image(image, caption=f'"{result_prompt}"', use_container_width=True)
+
+        # HF already returns an encoded image, so offer those bytes as-is instead of re-encoding
+        st.download_button(
+            label=f"⬇️ Download Image ({image_format})",
+            data=image_bytes,
+            file_name=f"generated_image.{image_format.lower()}",
+            mime=Image.MIME.get(image_format, "image/png"),
+            use_container_width=True
+        )
+    except Exception as e:
+        st.error(f"❌ Could not render image: {str(e)}")